@@ -0,0 +1,20 @@
+#!/bin/sh
+# Compile index.py with mypyc into build/mypyc, which gunicorn.conf.py serves
+# while it matches the current index.py.
+#
+#   pip install -r requirements-build.txt
+#   ./build_mypyc.sh
+#
+# Set FREEZY_NO_COMPILE=1 to run the pure Python index.py instead, e.g. when
+# debugging: mypyc binds module functions early, so patching them on the
+# compiled module has no effect.
+set -e
+cd "$(dirname "$0")"
+rm -rf build/mypyc
+mkdir -p build/mypyc
+cp index.py build/mypyc/index.py
+cd build/mypyc
+mypyc index.py
+# Record which source was compiled, then keep only the extension module
+python -c "import hashlib; print(hashlib.sha256(open('index.py', 'rb').read()).hexdigest())" > index.py.sha256
+rm -rf index.py build .mypy_cache
@@ -0,0 +1,51 @@
+import glob
+import hashlib
+import importlib.util
+import multiprocessing
+import os
+import sys
+
+# Loaded automatically by `gunicorn` from the project root
+wsgi_app = "index:app"
+bind = f"0.0.0.0:{os.getenv('PORT', 3000)}"
+
+# Serve the mypyc build from build_mypyc.sh while it matches index.py.
+# FREEZY_NO_COMPILE=1 forces the pure Python module, e.g. for debugging.
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+_MYPYC_DIR = os.path.join(_ROOT, "build", "mypyc")
+if glob.glob(os.path.join(_ROOT, "index.*.so")) + glob.glob(os.path.join(_ROOT, "index.*.pyd")):
+    raise RuntimeError("A compiled index module sits next to index.py and would shadow it; "
+                       "remove it and build with ./build_mypyc.sh instead")
+
+def _mypyc_build_is_current():
+    try:
+        with open(os.path.join(_MYPYC_DIR, "index.py.sha256")) as f:
+            built = f.read().strip()
+        with open(os.path.join(_ROOT, "index.py"), "rb") as f:
+            current = hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return False
+    return built == current
+
+if os.getenv("FREEZY_NO_COMPILE") != "1":
+    if _mypyc_build_is_current():
+        pythonpath = _MYPYC_DIR
+    elif os.path.isdir(_MYPYC_DIR):
+        sys.stderr.write("build/mypyc is out of date with index.py; serving the pure Python module\n")
+
+# Gevent workers so a slow Slack API call doesn't hold up other commands.
+# Free-threaded installs (requirements-core.txt) have no gevent, so they get
+# real threads instead; the app's shared state is guarded by explicit locks.
+_gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+if _gil_enabled and importlib.util.find_spec("gevent") is not None:
+    worker_class = "gevent"
+    worker_connections = 1000
+else:
+    worker_class = "gthread"
+    threads = int(os.getenv("FREEZY_THREADS", 8))
+
+# Frozen repos are shared through SQLite, so scale workers with the CPUs
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+
+# Match slack.com's keep-alive so its connections get reused
+keepalive = 75
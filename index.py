@@ -1,123 +1,380 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import atexit
 import os
+import queue
+import re
+import sqlite3
 import hashlib
 import hmac
+import json
+import threading
 import time
+from urllib.parse import parse_qsl
+from typing import Any, Callable
 app = Flask(__name__)
 
+# orjson is skipped on free-threaded installs (see requirements-core.txt)
+def _stdlib_json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+try:
+    import orjson
+    _json_dumps: Callable[[Any], bytes] = orjson.dumps
+except ImportError:
+    _json_dumps = _stdlib_json_dumps
+
 # Env Variables
 load_dotenv()
-SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")
-SLACK_SIGNING_SECRET = os.getenv("SLACK_SIGNING_SECRET")
-SLACK_API_URL_ALL = os.getenv("SLACK_API_URL_ALL")
-SLACK_API_URL_EPHEMERAL = os.getenv("SLACK_API_URL_EPHEMERAL")
-frozen_repos = set()
+_missing = [name for name in (
+    "SLACK_BOT_TOKEN", "SLACK_SIGNING_SECRET", "SLACK_API_URL_ALL", "SLACK_API_URL_EPHEMERAL"
+) if not os.getenv(name)]
+if _missing:
+    raise RuntimeError(f"Missing environment variables: {', '.join(_missing)}")
+SLACK_BOT_TOKEN = os.environ["SLACK_BOT_TOKEN"]
+SLACK_SIGNING_SECRET = os.environ["SLACK_SIGNING_SECRET"]
+SLACK_API_URL_ALL = os.environ["SLACK_API_URL_ALL"]
+SLACK_API_URL_EPHEMERAL = os.environ["SLACK_API_URL_EPHEMERAL"]
+FREEZY_DB_PATH = os.getenv("FREEZY_DB_PATH", "freezy.db")
+
+# Derived once so the request path doesn't rebuild them
+SLACK_SIGNING_SECRET_BYTES = SLACK_SIGNING_SECRET.encode()
+SLACK_HEADERS = {
+    "Authorization": f"Bearer {SLACK_BOT_TOKEN}",
+    "Content-Type": "application/json"
+}
+
+# Frozen repos live in SQLite so every worker sees the same state;
+# rowid keeps them in freeze order. The lock guards the shared connection.
+# Waiting on another worker's write blocks the whole gevent worker, so keep
+# the busy timeout well inside Slack's 3 second ack window.
+SQLITE_TIMEOUT = 1.0
+_db: sqlite3.Connection | None = None
+_db_pid = 0
+_frozen_lock = threading.Lock()
+
+# Bumped by this worker's writes; data_version moves on other workers' writes.
+# Together they tell /check when its last rendered reply is stale.
+_frozen_generation = 0
+_check_cache: tuple[tuple[int, int], bytes] = ((-1, -1), b"")
+
+# One comma separated repo name with surrounding whitespace trimmed
+_REPO_RE = re.compile(r"[^,\s](?:[^,]*[^,\s])?")
+
+# Static replies
+HELP_MESSAGE = "👋 Hi there! I'm *Freezy*, your code freeze assistant. Here’s what I can do:\n\n🔍 *Check:* `/check` - View code freeze status\n❄️ *Freeze:* `/freeze [repo]` - Place code freeze on a repository\n🔥 *Unfreeze:* `/unfreeze [repo]` - Lift code freeze on a repository\n\nExample commands:\n✅ `/freeze api, cdm`\n✅ `/unfreeze cdm, api`\n\nLet me know how I can assist you! 🚀"
+NO_FROZEN_REPOS_MESSAGE = "✅ No repositories are currently on code freeze."
+UNFREEZE_ALL_MESSAGE = "🔥 Code freeze lifted on *all* repositories."
+
+# Announcement templates, filled with a sorted comma separated repo list
+_FREEZE_OK_TPL = "❄️ Code freeze placed on: *{}*.".format
+_UNFREEZE_OK_TPL = "🔥 Code freeze lifted on: *{}*.".format
+_ANNOUNCE_ACK_TPL = "{}\n_Announcing this in the channel._".format
+
+# Encode a reply once so it can be served as-is on every request
+def _encode_reply(text: str, ephemeral: bool = True, status: int = 200) -> tuple[bytes, int]:
+    body = {"response_type": "ephemeral", "text": text} if ephemeral else {"text": text}
+    return _json_dumps(body), status
+
+_STATIC_RESPONSES: dict[str, tuple[bytes, int]] = {
+    "unauthorized": (_json_dumps({"error": "Unauthorized request"}), 401),
+    "unknown_command": _encode_reply("Unknown command 🤖", ephemeral=False, status=400),
+    "help": _encode_reply(HELP_MESSAGE),
+    "no_frozen_repos": _encode_reply(NO_FROZEN_REPOS_MESSAGE),
+    "no_repo_freeze": _encode_reply("❄️ Please specify a repository to freeze. Example: `/freeze api`"),
+    "no_repo_unfreeze": _encode_reply("🔥 Please specify a repository to unfreeze. Example: `/unfreeze api`"),
+    "none_frozen_specified": _encode_reply("⚠️ None of the specified repositories are on code freeze."),
+    "state_unavailable": _encode_reply("⏳ Freeze status is unavailable right now. Please try again in a moment."),
+}
+
+# Announcements are posted in the background, so give Slack time to answer
+SLACK_TIMEOUT = (3, 5)
+
+# Shared Slack session so connections stay alive between commands
+SLACK_SESSION = requests.Session()
+SLACK_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=50,
+    max_retries=Retry(total=2, read=0, backoff_factor=0.1)
+))
+SLACK_SESSION.headers.update(SLACK_HEADERS)
+
+# Channel announcements are queued and posted off the request path; messages
+# for the same recipient that arrive within one window go out as one post.
+# A small pool of senders keeps one slow post from holding up other channels;
+# each channel always maps to the same sender so its posts stay in order.
+SLACK_BATCH_WINDOW = 0.05
+SLACK_BATCH_SIZE = 5
+SLACK_SENDERS = 4
+# Upper bound on how long exit waits for queued announcements to go out
+SLACK_FLUSH_TIMEOUT = 10.0
+# (channel_id, user_id, ephemeral, message); None tells the batcher to stop
+OutboxItem = tuple[str, str, bool, str] | None
+_slack_outbox: "queue.Queue[OutboxItem] | None" = None
+_slack_outbox_pid = 0
+_slack_outbox_lock = threading.Lock()
+
+# "v0=" followed by a hex encoded SHA-256 digest
+SLACK_DIGEST_SIZE = 32
+SLACK_SIGNATURE_LENGTH = 3 + 2 * SLACK_DIGEST_SIZE
 
 # Only process requests from Slack
-def verify_slack_request(req):
+def verify_slack_request(req: Request) -> bool:
     timestamp = req.headers.get("X-Slack-Request-Timestamp")
     slack_signature = req.headers.get("X-Slack-Signature")
     if not timestamp or not slack_signature:
         return False 
-    if abs(time.time() - int(timestamp)) > 300:
+    # Reject stale or malformed requests before touching the body
+    if len(slack_signature) != SLACK_SIGNATURE_LENGTH or not slack_signature.startswith("v0="):
+        return False
+    try:
+        expected_signature = bytes.fromhex(slack_signature[3:])
+    except ValueError:
+        return False
+    if len(expected_signature) != SLACK_DIGEST_SIZE:
+        return False
+    try:
+        request_time = int(timestamp)
+    except ValueError:
+        return False
+    if abs(time.time() - request_time) > 300:
         return False  
-    body = req.get_data(as_text=True)
-    base = f"v0:{timestamp}:{body}"
-    computed_signature = "v0=" + hmac.new(
-        SLACK_SIGNING_SECRET.encode(), base.encode(), hashlib.sha256
-    ).hexdigest()
-    return hmac.compare_digest(computed_signature, slack_signature)
+    # Sign the raw body bytes without building the base string; the one-shot
+    # hmac.digest() would need "v0:{timestamp}:{body}" concatenated first
+    mac = hmac.new(SLACK_SIGNING_SECRET_BYTES, None, hashlib.sha256)
+    mac.update(b"v0:")
+    mac.update(timestamp.encode())
+    mac.update(b":")
+    mac.update(req.get_data())
+    return hmac.compare_digest(mac.digest(), expected_signature)
 
 # Helper for sending Slack
-def send_slack_message(channel_id, message, ephemeral, user_id):
-    payload = {"channel": channel_id, "text": message}
+def send_slack_message(channel_id: str, message: str, ephemeral: bool, user_id: str) -> bool:
+    payload: dict[str, str] = {"channel": channel_id, "text": message}
     if ephemeral: 
         payload["user"] = user_id
-    response = requests.post(
-        SLACK_API_URL_EPHEMERAL if ephemeral else SLACK_API_URL_ALL,
-        headers={
-            "Authorization": f"Bearer {SLACK_BOT_TOKEN}",
-            "Content-Type": "application/json"
-        },
-        json=payload
-    )   
-    if response.json().get("ok"):
-        return "", 200
-    else:
-        return "Error occurred", 500
-    
+    try:
+        response = SLACK_SESSION.post(
+            SLACK_API_URL_EPHEMERAL if ephemeral else SLACK_API_URL_ALL,
+            json=payload,
+            timeout=SLACK_TIMEOUT
+        )
+        result = response.json()
+    except (requests.RequestException, ValueError) as e:
+        app.logger.error("Slack message to %s failed: %s", channel_id, e)
+        return False
+    if not result.get("ok"):
+        app.logger.error("Slack message to %s failed: %s", channel_id, result.get("error"))
+        return False
+    return True
+
+# Open the connection lazily, once per process, so it is never shared across a fork.
+# Callers must hold _frozen_lock.
+def _get_db() -> sqlite3.Connection:
+    global _db, _db_pid
+    if _db is None or _db_pid != os.getpid():
+        db = sqlite3.connect(FREEZY_DB_PATH, timeout=SQLITE_TIMEOUT, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS frozen_repos (name TEXT PRIMARY KEY)")
+        _db, _db_pid = db, os.getpid()
+    return _db
+
+# Batch the outbox, flushing every batch window or every few messages
+def _batch_slack_outbox(outbox: "queue.Queue[OutboxItem]", posts: "list[queue.Queue[OutboxItem]]") -> None:
+    stopping = False
+    while not stopping:
+        first = outbox.get()
+        if first is None:
+            break
+        batch = [first]
+        deadline = time.monotonic() + SLACK_BATCH_WINDOW
+        while len(batch) < SLACK_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = outbox.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        try:
+            grouped: dict[tuple[str, str, bool], list[str]] = {}
+            for channel_id, user_id, ephemeral, message in batch:
+                grouped.setdefault((channel_id, user_id, ephemeral), []).append(message)
+            for (channel_id, user_id, ephemeral), messages in grouped.items():
+                posts[hash(channel_id) % SLACK_SENDERS].put((channel_id, user_id, ephemeral, "\n".join(messages)))
+        except Exception:
+            app.logger.exception("Failed to batch Slack announcements")
+    # Pending batches are queued ahead of these, so senders finish them first
+    for sender_posts in posts:
+        sender_posts.put(None)
+
+# Post batched announcements until told to stop
+def _send_slack_posts(posts: "queue.Queue[OutboxItem]") -> None:
+    while True:
+        post = posts.get()
+        if post is None:
+            return
+        channel_id, user_id, ephemeral, message = post
+        try:
+            send_slack_message(channel_id, message, ephemeral, user_id)
+        except Exception:
+            app.logger.exception("Slack message to %s failed", channel_id)
+
+# Stop the batcher and wait for queued announcements to be posted
+def _flush_slack_outbox(outbox: "queue.Queue[OutboxItem]", threads: list[threading.Thread]) -> None:
+    outbox.put(None)
+    deadline = time.monotonic() + SLACK_FLUSH_TIMEOUT
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+
+# Start the outbox threads lazily, once per process, so every forked worker gets its own
+def _get_slack_outbox() -> "queue.Queue[OutboxItem]":
+    global _slack_outbox, _slack_outbox_pid
+    with _slack_outbox_lock:
+        if _slack_outbox is None or _slack_outbox_pid != os.getpid():
+            outbox: "queue.Queue[OutboxItem]" = queue.Queue()
+            posts: "list[queue.Queue[OutboxItem]]" = [queue.Queue() for _ in range(SLACK_SENDERS)]
+            threads = [threading.Thread(
+                target=_batch_slack_outbox, args=(outbox, posts), name="slack-outbox", daemon=True
+            )] + [threading.Thread(
+                target=_send_slack_posts, args=(sender_posts,), name=f"slack-sender-{n}", daemon=True
+            ) for n, sender_posts in enumerate(posts)]
+            for thread in threads:
+                thread.start()
+            atexit.register(_flush_slack_outbox, outbox, threads)
+            _slack_outbox, _slack_outbox_pid = outbox, os.getpid()
+        return _slack_outbox
+
+# Slash command replies are JSON responses
+CommandResult = Response
+
+# Build a JSON response without going through Flask's jsonify
+def json_response(body: bytes | dict[str, Any], status: int = 200) -> Response:
+    if not isinstance(body, bytes):
+        body = _json_dumps(body)
+    return app.response_class(body, status=status, mimetype="application/json")
+
+# Serve one of the pre-encoded replies
+def static_response(key: str) -> Response:
+    body, status = _STATIC_RESPONSES[key]
+    return json_response(body, status)
+
+# Post to the channel in the background and ack the command right away. The ack
+# repeats the outcome to the user, so a failed channel post never hides a change.
+def announce(channel_id: str, message: str, user_id: str) -> CommandResult:
+    _get_slack_outbox().put((channel_id, user_id, False, message))
+    return json_response({"response_type": "ephemeral", "text": _ANNOUNCE_ACK_TPL(message)})
+
 
 @app.route("/slack/command", methods=["POST"])
-def slack_command():
+def slack_command() -> CommandResult:
     if not verify_slack_request(request):
-        return jsonify({"error": "Unauthorized request"}), 401
+        return static_response("unauthorized")
     
     # Extract command, parameters, and the channel id
-    data = request.form
-    command = data.get("command")
+    # Parse the body already read for verification instead of request.form
+    data = dict(parse_qsl(request.get_data(as_text=True), keep_blank_values=True))
+    command = data.get("command", "")
     command_text = data.get("text", "").strip()
-    channel_id = data.get("channel_id")
-    user_id = data.get("user_id")
+    channel_id = data.get("channel_id", "")
+    user_id = data.get("user_id", "")
     
-    # Available commands
-    command_handlers = {
-        "/help": lambda: handle_help(channel_id, user_id),
-        "/check": lambda: handle_check(channel_id, user_id),
-        "/freeze": lambda: handle_freeze(command_text,channel_id, user_id),
-        "/unfreeze": lambda: handle_unfreeze(command_text,channel_id, user_id)
-    }
-    
-    if command in command_handlers:
-        return command_handlers[command]()
+    handler = COMMAND_HANDLERS.get(command)
+    if handler:
+        try:
+            return handler(command_text, channel_id, user_id)
+        except sqlite3.Error as e:
+            # Locked, unreadable or corrupt database: answer within the ack window instead of a 500
+            app.logger.error("Freeze state unavailable for %s: %s", command, e)
+            return static_response("state_unavailable")
 
     # Invalid command handling
-    return jsonify({"text": "Unknown command 🤖"}), 400
+    return static_response("unknown_command")
 
-def handle_help(channel_id, user_id):
-    message = "👋 Hi there! I'm *Freezy*, your code freeze assistant. Here’s what I can do:\n\n🔍 *Check:* `/check` - View code freeze status\n❄️ *Freeze:* `/freeze [repo]` - Place code freeze on a repository\n🔥 *Unfreeze:* `/unfreeze [repo]` - Lift code freeze on a repository\n\nExample commands:\n✅ `/freeze api, cdm`\n✅ `/unfreeze cdm, api`\n\nLet me know how I can assist you! 🚀"
-    return send_slack_message(channel_id, message, True, user_id)
+def handle_help(command_text: str, channel_id: str, user_id: str) -> CommandResult:
+    return static_response("help")
 
-def handle_check(channel_id, user_id):
-    if not frozen_repos:
-        message = "✅ No repositories are currently on code freeze."
-    else:
-        frozen_list = "\n".join(f"- *{repo}*" for repo in frozen_repos)
-        message = f"🚨 The following repositories are on code freeze:\n{frozen_list}"
-    return send_slack_message(channel_id, message, True, user_id)
+def handle_check(command_text: str, channel_id: str, user_id: str) -> CommandResult:
+    global _check_cache
+    with _frozen_lock:
+        db = _get_db()
+        generation = (db.execute("PRAGMA data_version").fetchone()[0], _frozen_generation)
+        cached_generation, body = _check_cache
+        if cached_generation == generation:
+            return json_response(body)
+        repos = [name for (name,) in db.execute("SELECT name FROM frozen_repos ORDER BY rowid")]
+    if not repos:
+        return static_response("no_frozen_repos")
+    frozen_list = "\n".join(f"- *{repo}*" for repo in repos)
+    message = f"🚨 The following repositories are on code freeze:\n{frozen_list}"
+    body = _json_dumps({"response_type": "ephemeral", "text": message})
+    _check_cache = (generation, body)
+    return json_response(body)
 
-def handle_freeze(repo_name, channel_id, user_id):
+def handle_freeze(repo_name: str, channel_id: str, user_id: str) -> CommandResult:
+    global _frozen_generation
     if not repo_name:
-        message = "❄️ Please specify a repository to freeze. Example: `/freeze api`"
-        return send_slack_message(channel_id, message, True, user_id)
-    repos = {repo.strip().upper() for repo in repo_name.split(",") if repo.strip()}
-    frozen_repos.update(repos)
-    message = f"❄️ Code freeze placed on: *{', '.join(repos)}*."
-    return send_slack_message(channel_id, message, False, user_id)
-
-def handle_unfreeze(repo_name, channel_id, user_id):
+        return static_response("no_repo_freeze")
+    repos = dict.fromkeys(_REPO_RE.findall(repo_name.upper()))
+    with _frozen_lock:
+        db = _get_db()
+        with db:
+            added = db.executemany(
+                "INSERT OR IGNORE INTO frozen_repos (name) VALUES (?)", ((repo,) for repo in repos)
+            ).rowcount
+        if added:
+            _frozen_generation += 1
+    message = _FREEZE_OK_TPL(", ".join(sorted(repos)))
+    return announce(channel_id, message, user_id)
+
+def handle_unfreeze(repo_name: str, channel_id: str, user_id: str) -> CommandResult:
+    global _frozen_generation
     if not repo_name:
-        message = "🔥 Please specify a repository to unfreeze. Example: `/unfreeze api`"
-        return send_slack_message(channel_id, message, True, user_id)
+        return static_response("no_repo_unfreeze")
     
     if repo_name.lower() == "all":  
-        if not frozen_repos:
-            message = "✅ No repositories are currently on code freeze."
+        with _frozen_lock:
+            db = _get_db()
+            with db:
+                cleared = db.execute("DELETE FROM frozen_repos").rowcount
+            if cleared:
+                _frozen_generation += 1
+        if not cleared:
+            message = NO_FROZEN_REPOS_MESSAGE
         else:
-            frozen_repos.clear()
-            message = "🔥 Code freeze lifted on *all* repositories."
-        return send_slack_message(channel_id, message, False, user_id)
+            message = UNFREEZE_ALL_MESSAGE
+        return announce(channel_id, message, user_id)
         
-    repos = {repo.strip().upper() for repo in repo_name.split(",") if repo.strip()}
-    unfrozen = repos.intersection(frozen_repos)
+    # Single pass over the requested repos, one delete each
+    unfrozen: list[str] = []
+    with _frozen_lock:
+        db = _get_db()
+        with db:
+            for repo in dict.fromkeys(_REPO_RE.findall(repo_name.upper())):
+                if db.execute("DELETE FROM frozen_repos WHERE name = ?", (repo,)).rowcount:
+                    unfrozen.append(repo)
+        if unfrozen:
+            _frozen_generation += 1
     if not unfrozen:
-        message = "⚠️ None of the specified repositories are on code freeze."
-        return send_slack_message(channel_id, message, True, user_id)
+        return static_response("none_frozen_specified")
     
-    frozen_repos.difference_update(unfrozen)
-    message = f"🔥 Code freeze lifted on: *{', '.join(unfrozen)}*."
-    return send_slack_message(channel_id, message, False, user_id)
+    message = _UNFREEZE_OK_TPL(", ".join(sorted(unfrozen)))
+    return announce(channel_id, message, user_id)
+
+# Available commands
+COMMAND_HANDLERS: dict[str, Callable[[str, str, str], CommandResult]] = {
+    "/help": handle_help,
+    "/check": handle_check,
+    "/freeze": handle_freeze,
+    "/unfreeze": handle_unfreeze
+}
 
 # if __name__ == "__main__":
 #     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 3000)), debug=os.getenv("DEBUG", "False") == "True")